@@ -1,14 +1,31 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
+import numpy as np
+import os
+import re
+import sys
 import json
-import ast
-import operator as op
+import logging
 import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from scanner import (
+    PERIOD_MAP, RefreshingCache, SmtpConnection, bar_epoch, compile_trigger, download, parse_trigger, scan,
+    send_email, send_telegram
+)
+
+# =========================
+# CONSTANTS
+# =========================
+FILE_MAP = {
+    "Nifty50": "Nifty50.txt",
+    "Nifty500": "Nifty500.txt",
+    "Forex Pairs": "Forex_Pairs.txt"
+}
+SOURCE_OPTIONS = list(FILE_MAP) + ["Upload File"]
+TIMEFRAMES = list(PERIOD_MAP)
 
 # =========================
 # PAGE CONFIG AND BACKGROUND
@@ -41,16 +58,61 @@ alert_emails = st.secrets["alert_emails"]
 telegram_token = st.secrets["telegram_token"]
 telegram_chat_id = st.secrets["telegram_chat_id"]
 
+@st.cache_resource
+def smtp_connection():
+    return SmtpConnection(gmail_user, gmail_password)
+
+# Shared by every session so Telegram alerts reuse keep-alive TLS connections across reruns
+@st.cache_resource
+def telegram_session():
+    session = requests.Session()
+    # Only connection failures are retried: the message never left, so a retry cannot double-post.
+    # 429s are handled in send_telegram using Telegram's retry_after
+    retries = Retry(total=3, read=0, backoff_factor=0.5)
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+    return session
+
+@st.cache_resource
+def alert_pool():
+    return ThreadPoolExecutor(max_workers=4)
+
+# Nobody waits on alert futures, so without this a failed send would vanish silently
+def log_alert_failure(future):
+    error = future.exception()
+    if error is not None:
+        logging.error("Alert delivery failed", exc_info=error)
+
 # =========================
 # LOAD TRIGGERS
 # =========================
+# The file's mtime is part of the key, so edits are picked up without restarting the app
+@st.cache_resource
+def load_triggers(path, mtime):
+    with open(path, "r") as f:
+        return json.load(f)
+
+# Every formula is validated once per file version so broken ones show up straight away. Compiling
+# is left to the scan: compiling every Numba kernel up front held the compiler lock for seconds
+# while the first scan waited to compile its own trigger
+@st.cache_resource
+def validate_triggers(path, mtime):
+    broken = {}
+    for name, formula in load_triggers(path, mtime).items():
+        try:
+            parse_trigger(formula)
+        except (SyntaxError, ValueError) as e:
+            broken[name] = e
+    return broken
+
 try:
-    with open("triggers.json", "r") as f:
-        trigger_formulas = json.load(f)
+    triggers_mtime = os.path.getmtime("triggers.json")
 except FileNotFoundError:
     st.error("triggers.json not found")
     st.stop()
 
+trigger_formulas = load_triggers("triggers.json", triggers_mtime)
+broken_triggers = validate_triggers("triggers.json", triggers_mtime)
+
 # =========================
 # LAYOUT (LEFT + RIGHT)
 # =========================
@@ -64,15 +126,14 @@ with left_col:
 
     st.session_state.timeframe = st.selectbox(
         "Timeframe",
-        ["15m", "1d"],
-        index=["15m", "1d"].index(st.session_state.timeframe)
+        TIMEFRAMES,
+        index=TIMEFRAMES.index(st.session_state.timeframe)
     )
 
     st.session_state.source_option = st.radio(
         "Ticker Source",
-        ["Nifty50", "Nifty500", "Forex Pairs", "Upload File"],
-        index=["Nifty50","Nifty500","Forex Pairs","Upload File"]
-        .index(st.session_state.source_option)
+        SOURCE_OPTIONS,
+        index=SOURCE_OPTIONS.index(st.session_state.source_option)
     )
 
     st.session_state.alerts_active = st.checkbox(
@@ -83,89 +144,46 @@ with left_col:
     st.subheader("Trigger")
     trigger_condition = st.selectbox("Trigger Condition", list(trigger_formulas.keys()))
     trigger_text = st.text_input("Edit Trigger", value=trigger_formulas[trigger_condition])
+    if broken_triggers:
+        st.warning(f"Invalid formulas in triggers.json: {', '.join(broken_triggers)}")
 
     scan_clicked = st.button("Scan Market", type="primary")
 
 # =========================
 # LOAD TICKERS
 # =========================
+def parse_tickers(content):
+    # One regex split handles commas, newlines and stray whitespace; interned so symbol lookups
+    # in the scan's dicts and sets compare by identity
+    return tuple(sys.intern(t) for t in re.split(r"[,\s]+", content.upper()) if t)
+
+@st.cache_resource
+def load_tickers(source, mtime):
+    with open(FILE_MAP[source], "r") as f:
+        return parse_tickers(f.read())
+
 tickers = []
 
-if st.session_state.source_option in ["Nifty50","Nifty500","Forex Pairs"]:
-    file_map = {
-        "Nifty50": "Nifty50.txt",
-        "Nifty500": "Nifty500.txt",
-        "Forex Pairs": "Forex_Pairs.txt"
-    }
-    with open(file_map[st.session_state.source_option], "r") as f:
-        content = f.read()
-    tickers = [t.strip().upper() for t in content.split(",") if t.strip()]
+if st.session_state.source_option in FILE_MAP:
+    source_path = FILE_MAP[st.session_state.source_option]
+    tickers = list(load_tickers(st.session_state.source_option, os.path.getmtime(source_path)))
 
 elif st.session_state.source_option == "Upload File":
     uploaded = st.file_uploader("Upload tickers", type=["txt","csv"])
     if uploaded:
         content = uploaded.read().decode("utf-8")
-        st.session_state.uploaded_tickers = [
-            t.strip().upper()
-            for t in content.replace("\n", ",").split(",")
-            if t.strip()
-        ]
+        st.session_state.uploaded_tickers = list(parse_tickers(content))
     tickers = st.session_state.uploaded_tickers
 
 # =========================
-# AST TRIGGER ENGINE
+# MARKET DATA
 # =========================
-operators = {
-    ast.Gt: op.gt, ast.Lt: op.lt, ast.GtE: op.ge, ast.LtE: op.le,
-    ast.Eq: op.eq, ast.NotEq: op.ne,
-    ast.Add: op.add, ast.Sub: op.sub,
-    ast.Mult: op.mul, ast.Div: op.truediv,
-    ast.And: lambda a,b: a and b,
-    ast.Or: lambda a,b: a or b
-}
-allowed_functions = {"abs": abs, "max": max, "min": min}
-
-def check_trigger(df, condition):
-    def get_value(name, index=-1):
-        return float(df.iloc[index][name])
-
-    def _eval(node):
-        if isinstance(node, ast.Expression):
-            return _eval(node.body)
-        elif isinstance(node, ast.BoolOp):
-            result = _eval(node.values[0])
-            for v in node.values[1:]:
-                result = operators[type(node.op)](result, _eval(v))
-            return result
-        elif isinstance(node, ast.UnaryOp):
-            if isinstance(node.op, ast.USub):
-                return -_eval(node.operand)
-            if isinstance(node.op, ast.Not):
-                return not _eval(node.operand)
-        elif isinstance(node, ast.Compare):
-            return operators[type(node.ops[0])](_eval(node.left), _eval(node.comparators[0]))
-        elif isinstance(node, ast.BinOp):
-            return operators[type(node.op)](_eval(node.left), _eval(node.right))
-        elif isinstance(node, ast.Subscript):
-            field = node.value.id
-            index = node.slice.value if isinstance(node.slice, ast.Constant) else _eval(node.slice)
-            return get_value(field, index)
-        elif isinstance(node, ast.Call):
-            func_name = node.func.id
-            if func_name not in allowed_functions:
-                raise ValueError("Function not allowed")
-            return allowed_functions[func_name](*[_eval(arg) for arg in node.args])
-        elif isinstance(node, ast.Name):
-            return get_value(node.id)
-        elif isinstance(node, ast.Constant):
-            return node.value
-        else:
-            raise TypeError(node)
-    try:
-        parsed = ast.parse(condition, mode="eval")
-        return bool(_eval(parsed))
-    except:
-        return False
+@st.cache_resource
+def market_data():
+    return RefreshingCache(download, ttl=60, epoch=lambda tickers, timeframe: bar_epoch(timeframe))
+
+def fetch_data(tickers, timeframe):
+    return market_data().get(tickers, timeframe)
 
 # =========================
 # RIGHT PANEL (RESULTS)
@@ -179,54 +197,43 @@ with right_col:
             st.warning("No tickers loaded.")
             st.stop()
 
+        try:
+            trigger = compile_trigger(trigger_text)
+        except (SyntaxError, ValueError) as e:
+            st.error(f"Invalid trigger expression: {e}")
+            st.stop()
+
         with st.spinner("Scanning..."):
-            raw = yf.download(
-                tickers=tickers,
-                period="5d" if st.session_state.timeframe=="15m" else "1mo",
-                interval=st.session_state.timeframe,
-                group_by="ticker",
-                progress=False,
-                threads=True
-            )
+            # Sorted and de-duplicated so reordered or repeated symbols share one cache entry
+            data = fetch_data(tuple(sorted(set(tickers))), st.session_state.timeframe)
 
-            if raw.empty:
+            if not data:
                 st.warning("No data received.")
                 st.stop()
 
-            if not isinstance(raw.columns, pd.MultiIndex):
-                raw = pd.concat({tickers[0]: raw}, axis=1)
-
-            results = []
-
-            for ticker in tickers:
-                if ticker not in raw:
-                    continue
-
-                df = raw[ticker].dropna().tail(15)
-                if df.empty:
-                    continue
-
-                triggered = check_trigger(df, trigger_text)
-                current_price = float(df["Close"].iloc[-1])
-                yahoo_finance_link = f"https://finance.yahoo.com/chart/{ticker}"
-
-                results.append({
-                    "Ticker": f"🚨 {ticker}" if triggered else ticker,
-                    "RawTicker": ticker,
-                    "Current Price": round(current_price, 2),
-                    "Triggered": triggered,
-                    "Chart Link": f'<a href="{yahoo_finance_link}" target="_blank">View Chart</a>'
-                })
-
-            result_df = pd.DataFrame(results)
-            result_df = result_df.sort_values(by="Triggered", ascending=False)
+            scanned, triggered, current_prices = scan(data, tickers, trigger)
+
+            result_df = pd.DataFrame({
+                "RawTicker": pd.Series(scanned, dtype=object),
+                "Current Price": np.round(current_prices, 2),
+                "Triggered": triggered
+            })
+            result_df["Ticker"] = np.where(triggered, "🚨 " + result_df["RawTicker"], result_df["RawTicker"])
+            result_df["Chart Link"] = "https://finance.yahoo.com/chart/" + result_df["RawTicker"]
+            # Triggered rows first, each group kept in ticker-file order: an O(N) partition, no sort
+            order = np.concatenate([np.flatnonzero(triggered), np.flatnonzero(~triggered)])
+            result_df = result_df.take(order)
             display_df = result_df[["Ticker", "Current Price", "Chart Link"]]
 
-            triggered_count = result_df["Triggered"].sum()
+            triggered_count = int(triggered.sum())
             total_processed = len(result_df)
             st.success(f"{triggered_count} of {total_processed} Stocks Triggered")
 
-            st.markdown(display_df.to_html(escape=False), unsafe_allow_html=True)
+            st.dataframe(
+                display_df,
+                hide_index=True,
+                column_config={"Chart Link": st.column_config.LinkColumn("Chart", display_text="View Chart")}
+            )
 
             # =========================
             # ALERT LOGIC
@@ -238,27 +245,15 @@ with right_col:
                 if new_triggers:
                     message = f"{trigger_text}\nTriggered: {', '.join(new_triggers)}"
 
-                    # Telegram alert
-                    requests.post(
-                        f"https://api.telegram.org/bot{telegram_token}/sendMessage",
-                        data={"chat_id": telegram_chat_id, "text": message}
-                    )
-
-                    # Email alert
-                    try:
-                        msg = MIMEMultipart()
-                        msg["From"] = gmail_user
-                        msg["To"] = ",".join(alert_emails)
-                        msg["Subject"] = "YachtCode Alert"
-                        msg.attach(MIMEText(message, "plain"))
-
-                        server = smtplib.SMTP("smtp.gmail.com", 587)
-                        server.starttls()
-                        server.login(gmail_user, gmail_password)
-                        server.sendmail(gmail_user, alert_emails, msg.as_string())
-                        server.quit()
-                    except:
-                        pass
+                    # Fire-and-forget on the shared pool: the scan never waits on Telegram/SMTP,
+                    # and a failed send only loses that alert (it is logged)
+                    pool = alert_pool()
+                    pool.submit(
+                        send_telegram, telegram_session(), telegram_token, telegram_chat_id, message
+                    ).add_done_callback(log_alert_failure)
+                    pool.submit(
+                        send_email, smtp_connection(), alert_emails, "YachtCode Alert", message
+                    ).add_done_callback(log_alert_failure)
 
                     st.session_state.alerted_tickers.update(new_triggers)
 
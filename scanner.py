@@ -0,0 +1,570 @@
+import ast
+import collections
+import copy
+import functools
+import smtplib
+import threading
+import time
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# =========================
+# CONSTANTS
+# =========================
+FIELDS = ("Open", "High", "Low", "Close", "Volume")
+field_index = {name: i for i, name in enumerate(FIELDS)}
+WINDOW = 15
+PERIOD_MAP = {"15m": "5d", "1d": "1mo"}
+BAR_SECONDS = {"15m": 15 * 60, "1d": 24 * 60 * 60}
+CHUNK_SIZE = 20
+DOWNLOAD_WORKERS = 8
+TELEGRAM_ATTEMPTS = 3
+
+# =========================
+# AST TRIGGER ENGINE
+# =========================
+allowed_operators = (
+    ast.Gt, ast.Lt, ast.GtE, ast.LtE, ast.Eq, ast.NotEq,
+    ast.Add, ast.Sub, ast.Mult, ast.Div,
+    ast.And, ast.Or, ast.USub, ast.Not
+)
+allowed_nodes = (
+    ast.Expression, ast.BoolOp, ast.UnaryOp, ast.Compare, ast.BinOp,
+    ast.Subscript, ast.Call, ast.Name, ast.Constant, ast.Load
+) + allowed_operators
+allowed_functions = {"abs": np.abs, "max": np.maximum, "min": np.minimum}
+vector_globals = {
+    "__builtins__": {}, **allowed_functions,
+    "logical_and": np.logical_and, "logical_or": np.logical_or, "logical_not": np.logical_not,
+    "float64": np.float64, "where": np.where
+}
+CompiledTrigger = collections.namedtuple("CompiledTrigger", ["code", "depth", "kernel", "fields", "denominators"])
+
+class TriggerValidator(ast.NodeVisitor):
+    def generic_visit(self, node):
+        if not isinstance(node, allowed_nodes):
+            raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+        super().generic_visit(node)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in allowed_functions or node.keywords:
+            raise ValueError("Function not allowed")
+        # abs maps to np.abs, whose second positional argument is `out=`, so it must take exactly one
+        if node.func.id == "abs" and len(node.args) != 1:
+            raise ValueError("abs() takes exactly one argument")
+        if node.func.id != "abs" and len(node.args) < 2:
+            raise ValueError(f"{node.func.id}() needs at least two arguments")
+        for arg in node.args:
+            self.visit(arg)
+
+    def visit_Constant(self, node):
+        # Only real numbers: bools, strings, None and complex would fail or misbehave inside numpy
+        if type(node.value) not in (int, float):
+            raise ValueError(f"Unsupported constant: {node.value!r}")
+        try:
+            float(node.value)
+        except OverflowError:
+            raise ValueError("Number out of range") from None
+
+    def visit_Name(self, node):
+        if node.id not in field_index:
+            raise ValueError(f"Unknown field: {node.id}")
+
+    def visit_Subscript(self, node):
+        if not isinstance(node.value, ast.Name):
+            raise ValueError("Only fields can be indexed")
+        self.visit(node.value)
+        # Checked structurally rather than with literal_eval, which raises TypeError on e.g. {[1]: 1}
+        index = node.slice
+        negative = isinstance(index, ast.UnaryOp) and isinstance(index.op, ast.USub)
+        if negative:
+            index = index.operand
+        bar = index.value if isinstance(index, ast.Constant) and type(index.value) is int else None
+        if bar is not None and negative:
+            bar = -bar
+        if bar is None or not -WINDOW <= bar < WINDOW:
+            raise ValueError(f"Bar index must be a whole number from {-WINDOW} to {WINDOW - 1}")
+
+class TriggerVectorizer(ast.NodeTransformer):
+    # Rewrites the scalar expression so every field is a (WINDOW, tickers) array:
+    # Field -> Field[-1], and/or/not -> logical ufuncs, max/min -> pairwise ufuncs.
+    # Boolean results used as numbers are cast to float first, since numpy's bool + bool is a
+    # logical or and -bool raises, where Python (and the Numba kernel) treat True as 1.
+    # and/or on numbers keep Python's value semantics (`a or b` is a if a is truthy, else b) via where
+    def __init__(self):
+        self.depth = 1
+        self.fields = set()
+        self.denominators = []
+
+    def visit_Name(self, node):
+        self.fields.add(node.id)
+        return ast.Subscript(value=node, slice=ast.Constant(-1), ctx=ast.Load())
+
+    def visit_Subscript(self, node):
+        self.fields.add(node.value.id)
+        index = ast.literal_eval(node.slice)
+        self.depth = max(self.depth, -index) if index < 0 else WINDOW
+        return node
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return functools.reduce(lambda a, b: self._bool_op(node.op, a, b), node.values)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        node.left = self._numeric(node.left)
+        node.right = self._numeric(node.right)
+        if isinstance(node.op, ast.Div):
+            # Copied before CommonSubexpressions rewrites the main tree in place
+            self.denominators.append(copy.deepcopy(node.right))
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call("logical_not", node.operand)
+        node.operand = self._numeric(node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        pairs = [
+            ast.Compare(left=operands[i], ops=[cmp], comparators=[operands[i + 1]])
+            for i, cmp in enumerate(node.ops)
+        ]
+        return functools.reduce(lambda a, b: self._call("logical_and", a, b), pairs)
+
+    def visit_Call(self, node):
+        # Never more than two positional arguments: a third would be a ufunc's `out=` array
+        args = [self._numeric(self.visit(arg)) for arg in node.args]
+        if node.func.id == "abs":
+            (arg,) = args
+            return self._call("abs", arg)
+        return functools.reduce(lambda a, b: self._call(node.func.id, a, b), args)
+
+    @staticmethod
+    def _call(func, *args):
+        return ast.Call(func=ast.Name(id=func, ctx=ast.Load()), args=list(args), keywords=[])
+
+    def _bool_op(self, op, a, b):
+        if self._is_bool(a) and self._is_bool(b):
+            return self._call("logical_and" if isinstance(op, ast.And) else "logical_or", a, b)
+        # `a` is evaluated twice; a copy keeps the two uses independent for CommonSubexpressions
+        truthy = ast.Compare(left=a, ops=[ast.NotEq()], comparators=[ast.Constant(0)])
+        if isinstance(op, ast.And):
+            return self._call("where", truthy, b, copy.deepcopy(a))
+        return self._call("where", truthy, copy.deepcopy(a), b)
+
+    @staticmethod
+    def _is_bool(node):
+        return isinstance(node, ast.Compare) or (
+            isinstance(node, ast.Call) and node.func.id in ("logical_and", "logical_or", "logical_not")
+        )
+
+    def _numeric(self, node):
+        return self._call("float64", node) if self._is_bool(node) else node
+
+class ConstantFolder(ast.NodeTransformer):
+    # Collapses arithmetic on literals (e.g. 0.333 / 100) once at compile time
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant):
+            return self._fold(node)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+            return self._fold(node)
+        return node
+
+    @staticmethod
+    def _fold(node):
+        try:
+            value = eval(compile(ast.fix_missing_locations(ast.Expression(node)), "<fold>", "eval"), {"__builtins__": {}})
+        except ZeroDivisionError:
+            # Python would raise here at scan time too, since literal-only arithmetic never reaches numpy
+            raise ValueError("Division by zero") from None
+        except (ArithmeticError, TypeError):
+            # Non-numeric literals are already rejected by TriggerValidator; never fail compilation here
+            return node
+        try:
+            float(value)
+        except OverflowError:
+            raise ValueError("Number out of range") from None
+        return ast.copy_location(ast.Constant(value), node)
+
+class CommonSubexpressions(ast.NodeTransformer):
+    # Runs on the vectorised tree, where every operand is evaluated (no short-circuiting), in source
+    # order. The first copy of a repeated array expression binds it with :=, later copies reuse the name.
+    def __init__(self, tree):
+        self.counts = collections.Counter(
+            ast.dump(node) for node in ast.walk(tree) if isinstance(node, (ast.BinOp, ast.Call))
+        )
+        self.names = {}
+
+    def visit_BinOp(self, node):
+        return self._share(node)
+
+    def visit_Call(self, node):
+        return self._share(node)
+
+    def _share(self, node):
+        key = ast.dump(node)
+        if key in self.names:
+            return ast.Name(id=self.names[key], ctx=ast.Load())
+        self.generic_visit(node)
+        if self.counts[key] < 2:
+            return node
+        name = self.names[key] = f"_cse{len(self.names)}"
+        return ast.NamedExpr(target=ast.Name(id=name, ctx=ast.Store()), value=node)
+
+class TriggerKernelWriter(ast.NodeTransformer):
+    # Rewrites the scalar expression to read window[t, bar, field] for one ticker t
+    def visit_Name(self, node):
+        return self._cell(node.id, ast.Constant(-1))
+
+    def visit_Subscript(self, node):
+        # Kernels run without bounds checks; TriggerValidator keeps bars inside the window
+        return self._cell(node.value.id, ast.Constant(ast.literal_eval(node.slice)))
+
+    def visit_Call(self, node):
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    @staticmethod
+    def _cell(field, bar):
+        index = ast.Tuple(elts=[ast.Name(id="t", ctx=ast.Load()), bar, ast.Constant(field_index[field])], ctx=ast.Load())
+        return ast.Subscript(value=ast.Name(id="window", ctx=ast.Load()), slice=index, ctx=ast.Load())
+
+def build_kernel(parsed):
+    if numba is None:
+        return None
+    try:
+        body = ast.unparse(TriggerKernelWriter().visit(parsed).body)
+        # A plain serial loop: Streamlit sessions call kernels from several threads at once, which
+        # Numba's fallback workqueue threading layer aborts the process on, and a 15x5 window per
+        # ticker is too little work for prange to pay off anyway
+        source = (
+            "def trigger_kernel(window, out):\n"
+            "    for t in range(window.shape[0]):\n"
+            f"        out[t] = bool({body})\n"
+        )
+        namespace = {}
+        exec(source, namespace)
+        # Eager signature so typing errors surface here and we fall back to NumPy
+        return numba.njit("void(float64[:, :, ::1], boolean[::1])", error_model="numpy")(namespace["trigger_kernel"])
+    except Exception:
+        return None
+
+def parse_trigger(condition):
+    if not isinstance(condition, str):
+        raise ValueError("Trigger must be a string")
+    try:
+        parsed = ast.parse(condition, mode="eval")
+        TriggerValidator().visit(parsed)
+    except RecursionError:
+        raise ValueError("Expression is nested too deeply") from None
+    return parsed
+
+@functools.lru_cache(maxsize=64)
+def compile_trigger(condition):
+    parsed = parse_trigger(condition)
+    try:
+        # The writer and vectorizer rewrite in place, so each gets its own tree
+        kernel = build_kernel(ast.parse(condition, mode="eval"))
+        vectorizer = TriggerVectorizer()
+        tree = vectorizer.visit(ConstantFolder().visit(parsed))
+        tree = ast.fix_missing_locations(CommonSubexpressions(tree).visit(tree))
+        code = compile(tree, "<trigger>", "eval")
+        denominators = None
+        if vectorizer.denominators:
+            denominators = ast.Expression(ast.Tuple(elts=vectorizer.denominators, ctx=ast.Load()))
+            denominators = compile(ast.fix_missing_locations(denominators), "<denominators>", "eval")
+    except RecursionError:
+        raise ValueError("Expression is nested too deeply") from None
+    fields = tuple(f for f in FIELDS if f in vectorizer.fields)
+    return CompiledTrigger(code, vectorizer.depth, kernel, fields, denominators)
+
+def split_tickers(raw, tickers, fields=FIELDS):
+    # One reindex + reshape of the whole block instead of a MultiIndex lookup per ticker
+    available = set(raw.columns.get_level_values(0))
+    present = [t for t in dict.fromkeys(tickers) if t in available]
+    # Kept in float64: tick-rounded prices tie often (Close == Open), and float32 rounding flips those ties
+    block = raw.reindex(columns=pd.MultiIndex.from_product([present, fields])).to_numpy(dtype=np.float64)
+    block = block.reshape(len(raw), len(present), len(fields))
+    return {ticker: block[:, i] for i, ticker in enumerate(present)}
+
+def stack_window(per_ticker, fields=FIELDS):
+    # Right-align each ticker's last WINDOW bars into one (tickers, WINDOW, FIELDS) array;
+    # a bar only has to be complete in `fields`, the columns the trigger actually reads
+    cols = [field_index[f] for f in fields]
+    frames = {}
+    for ticker, arr in per_ticker.items():
+        # Mask a short tail first; only sparse tickers (e.g. mixed exchange calendars) need the full history
+        clean = arr[-2 * WINDOW:]
+        clean = clean[~np.isnan(clean[:, cols]).any(axis=1)]
+        if len(clean) < WINDOW:
+            clean = arr[~np.isnan(arr[:, cols]).any(axis=1)]
+        if len(clean):
+            frames[ticker] = clean[-WINDOW:]
+
+    window = np.full((len(frames), WINDOW, len(FIELDS)), np.nan)
+    for i, arr in enumerate(frames.values()):
+        window[i, WINDOW - len(arr):] = arr
+    return list(frames), window
+
+def evaluate_trigger(trigger, window):
+    bars = (~np.isnan(window[:, :, field_index["Close"]])).sum(axis=1)
+    valid = bars >= trigger.depth
+    namespace = {name: window[:, :, field_index[name]].T for name in trigger.fields}
+    if trigger.denominators is not None:
+        # Scalar evaluation raised ZeroDivisionError, which never triggered, on any zero denominator
+        # (every operand was evaluated); array division yields inf/nan instead, so mask those tickers
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for denominator in eval(trigger.denominators, vector_globals, namespace):
+                valid &= np.asarray(denominator) != 0
+
+    if trigger.kernel is not None:
+        result = np.empty(len(window), dtype=bool)
+        trigger.kernel(window, result)
+        return result & valid
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = eval(trigger.code, vector_globals, namespace)
+    return np.broadcast_to(np.asarray(result, dtype=bool), (len(window),)) & valid
+
+# =========================
+# SCAN
+# =========================
+window_cache = collections.OrderedDict()
+window_lock = threading.Lock()
+
+def cached_window(data, tickers, fields):
+    # RefreshingCache hands back the same dict until it reloads, so reruns and trigger edits
+    # reuse the stacked window; holding `data` in the entry keeps its id from being recycled
+    key = (id(data), tuple(tickers), fields)
+    with window_lock:
+        hit = window_cache.get(key)
+    if hit is not None and hit[0] is data:
+        return hit[1], hit[2]
+
+    per_ticker = {t: data[t] for t in dict.fromkeys(tickers) if t in data}
+    scanned, window = stack_window(per_ticker, fields)
+    with window_lock:
+        window_cache[key] = (data, scanned, window)
+        while len(window_cache) > 8:
+            window_cache.popitem(last=False)
+    return scanned, window
+
+def scan(data, tickers, trigger):
+    # Only the fields the trigger reads (plus Close for the price column) decide which bars are complete
+    fields = tuple(f for f in FIELDS if f in trigger.fields or f == "Close")
+    scanned, window = cached_window(data, tickers, fields)
+    return scanned, evaluate_trigger(trigger, window), window[:, -1, field_index["Close"]]
+
+# =========================
+# MARKET DATA
+# =========================
+def download_chunk(tickers, timeframe):
+    raw = yf.download(
+        tickers=list(tickers),
+        period=PERIOD_MAP[timeframe],
+        interval=timeframe,
+        group_by="ticker",
+        progress=False,
+        threads=False
+    )
+    if raw.empty:
+        return {}
+    if not isinstance(raw.columns, pd.MultiIndex):
+        raw = pd.concat({tickers[0]: raw}, axis=1)
+    # Each ticker becomes a plain (bars, FIELDS) array; the scan never touches the MultiIndex again
+    return split_tickers(raw, tickers)
+
+def download(tickers, timeframe):
+    # Small parallel requests finish in roughly the slowest chunk's time, not the sum
+    chunks = [tickers[i:i + CHUNK_SIZE] for i in range(0, len(tickers), CHUNK_SIZE)]
+    data = {}
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for part in executor.map(download_chunk, chunks, [timeframe] * len(chunks)):
+            data.update(part)
+    return data
+
+class RefreshingCache:
+    # Stale-while-revalidate: an entry past its ttl is still served while a background load replaces it,
+    # but only up to MAX_STALENESS ttls old (a failing or stuck refresh must not pin old data) and only
+    # within the bar it was loaded in (`epoch(*key)`). Past either limit the request reloads synchronously.
+    # Misses are not coalesced: sessions that hit a cold key at the same time each download it.
+    MAX_ENTRIES = 16
+    MAX_STALENESS = 2
+
+    def __init__(self, loader, ttl, epoch=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.epoch = epoch or (lambda *key: None)
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def get(self, *key):
+        epoch = self.epoch(*key)
+        with self.lock:
+            entry = self.entries.get(key)
+            age = time.monotonic() - entry[0] if entry is not None else 0
+            if entry is not None and (entry[1] != epoch or age > self.MAX_STALENESS * self.ttl):
+                entry = None
+            elif entry is not None and age > self.ttl and key not in self.refreshing:
+                self.refreshing.add(key)
+                self.executor.submit(self.refresh, key)
+        if entry is None:
+            return self.refresh(key)
+        return entry[2]
+
+    def refresh(self, key):
+        try:
+            # Tagged with the epoch at request time, so a load that straddles a bar close counts as old
+            epoch = self.epoch(*key)
+            value = self.loader(*key)
+            with self.lock:
+                self.entries.pop(key, None)
+                self.entries[key] = (time.monotonic(), epoch, value)
+                while len(self.entries) > self.MAX_ENTRIES:
+                    del self.entries[next(iter(self.entries))]
+            return value
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+def bar_epoch(timeframe):
+    return int(time.time() // BAR_SECONDS[timeframe])
+
+# =========================
+# ALERTS
+# =========================
+class TokenBucket:
+    # Adaptive rate limiter: creeps back up towards max_rate on success, halves on a 429
+    def __init__(self, rate, capacity, min_rate):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A caller that finds the bucket empty reserves the next token and sleeps until it is due
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+    def increase_rate(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def decrease_rate(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+# Telegram allows about 20 messages a minute into one group chat
+telegram_bucket = TokenBucket(rate=20 / 60, capacity=5, min_rate=1 / 60)
+
+def send_telegram(session, token, chat_id, message):
+    # Runs on the alert pool, so waiting out Telegram's flood control never holds up a scan.
+    # Failures raise (requests.HTTPError) so the pool's done-callback can log them
+    for attempt in range(TELEGRAM_ATTEMPTS):
+        telegram_bucket.acquire()
+        response = session.post(
+            f"https://api.telegram.org/bot{token}/sendMessage",
+            data={"chat_id": chat_id, "text": message},
+            timeout=5
+        )
+        if response.status_code != 429:
+            response.raise_for_status()
+            telegram_bucket.increase_rate()
+            return
+        telegram_bucket.decrease_rate()
+        if attempt + 1 < TELEGRAM_ATTEMPTS:
+            time.sleep(response.json().get("parameters", {}).get("retry_after", 1))
+    # Still rate limited after the last attempt
+    response.raise_for_status()
+
+class SmtpConnection:
+    # One logged-in Gmail session reused across alerts instead of connect/starttls/login per send
+    IDLE_CHECK = 100
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.server = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # The old session is closed first so a dropped or replaced connection never leaks its socket
+        self.close()
+        server = smtplib.SMTP("smtp.gmail.com", 587, timeout=10)
+        try:
+            server.starttls()
+            server.login(self.user, self.password)
+        except BaseException:
+            self._close(server)
+            raise
+        self.server = server
+
+    def close(self):
+        if self.server is not None:
+            self._close(self.server)
+            self.server = None
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def sendmail(self, recipients, message):
+        with self.lock:
+            # Gmail drops idle sessions, so probe with NOOP before reusing an old one
+            if self.server is not None and time.monotonic() - self.last_used > self.IDLE_CHECK:
+                try:
+                    alive = self.server.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    alive = False
+                if not alive:
+                    self.close()
+            if self.server is None:
+                self.connect()
+            try:
+                self.server.sendmail(self.user, recipients, message)
+            except smtplib.SMTPServerDisconnected:
+                self.connect()
+                self.server.sendmail(self.user, recipients, message)
+            self.last_used = time.monotonic()
+
+def send_email(connection, recipients, subject, message):
+    msg = MIMEMultipart()
+    msg["From"] = connection.user
+    msg["To"] = ",".join(recipients)
+    msg["Subject"] = subject
+    msg.attach(MIMEText(message, "plain"))
+    connection.sendmail(recipients, msg.as_string())
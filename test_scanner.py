@@ -0,0 +1,233 @@
+import json
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import requests
+
+import scanner
+from scanner import (
+    FIELDS, WINDOW, RefreshingCache, SmtpConnection, TokenBucket, compile_trigger, evaluate_trigger, send_telegram,
+    stack_window
+)
+
+with open("triggers.json", "r") as f:
+    BUNDLED = [formula for formula in json.load(f).values()]
+
+EXTRA = [
+    "(Close > Open) + (High > Low) >= 2",
+    "-(Close > Open) < 0",
+    "(Close > Open) - (Open > Close) > 0",
+    "abs(Close > Open) + abs(High < Low) >= 1",
+    "max(Close > Open, Volume > 5000) * 2 > 1",
+    "(Close > Open and High > Low) * 3 > 2",
+    "not Close > Open",
+    "Close[-1] > Close[-2] > Close[-3]",
+    "Close > 0.333 / 100 * Open",
+    "(Volume or Close) > 50",
+    "(Volume and Close) > 50",
+    "Close > (Open or High)",
+    "Close > (Volume and Open)",
+    "(Close > Open or Volume) > 1",
+    "Volume or Close > Open",
+    "Close / Volume > 1000",
+    "not Close / Volume > 1000",
+    "(High - Low) / (Close - Open) > 2",
+    "Volume / Volume[-2] > 0.5"
+]
+
+
+class Bars(float):
+    # Scalar stand-in for one ticker's field: the last bar as a float, earlier bars by index
+    def __new__(cls, values):
+        bars = super().__new__(cls, values[-1])
+        bars.values = values
+        return bars
+
+    def __getitem__(self, bar):
+        return float(self.values[bar])
+
+
+def reference(formula, window):
+    scope = {"__builtins__": {}, "abs": abs, "max": max, "min": min}
+
+    def triggered(t):
+        try:
+            return bool(eval(formula, scope, {name: Bars(window[t, :, i]) for i, name in enumerate(FIELDS)}))
+        except ZeroDivisionError:
+            return False
+
+    return np.array([triggered(t) for t in range(len(window))])
+
+
+@pytest.fixture(scope="module")
+def window():
+    # Prices on a 0.05 tick grid, so ties such as Close == Open actually occur
+    rng = np.random.default_rng(0)
+    per_ticker = {}
+    for t in range(200):
+        open_ = np.round((100 + rng.normal(0, 0.3, WINDOW).cumsum()) * 20) / 20
+        close = np.round((open_ + rng.normal(0, 0.2, WINDOW)) * 20) / 20
+        high = np.maximum(open_, close) + np.round(np.abs(rng.normal(0, 0.2, WINDOW)) * 20) / 20
+        low = np.minimum(open_, close) - np.round(np.abs(rng.normal(0, 0.2, WINDOW)) * 20) / 20
+        # Every tenth ticker has no volume, like forex pairs
+        volume = rng.integers(1, 10000, WINDOW).astype(float) * (t % 10 != 0)
+        per_ticker[f"T{t}"] = np.column_stack([open_, high, low, close, volume])
+    return stack_window(per_ticker)[1]
+
+
+def compiled_or_skip(formula):
+    try:
+        return compile_trigger(formula)
+    except ValueError as e:
+        pytest.skip(f"invalid formula: {e}")
+
+
+@pytest.mark.parametrize("formula", BUNDLED + EXTRA)
+def test_numpy_path_matches_reference(formula, window):
+    trigger = compiled_or_skip(formula)
+    before = window.copy()
+    result = evaluate_trigger(trigger._replace(kernel=None), window)
+    np.testing.assert_array_equal(result, reference(formula, window))
+    np.testing.assert_array_equal(window, before)
+
+
+@pytest.mark.parametrize("formula", BUNDLED + EXTRA)
+def test_kernel_matches_reference(formula, window):
+    trigger = compiled_or_skip(formula)
+    if trigger.kernel is None:
+        pytest.skip("numba not available for this formula")
+    np.testing.assert_array_equal(evaluate_trigger(trigger, window), reference(formula, window))
+
+
+def test_kernel_runs_from_concurrent_sessions(window):
+    trigger = compiled_or_skip(BUNDLED[0])
+    expected = evaluate_trigger(trigger, window)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for result in pool.map(lambda _: evaluate_trigger(trigger, window), range(64)):
+            np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("formula", [
+    "abs(Close, Open) > 0",
+    "abs() > 0",
+    "max(Close) > 0",
+    "Close > None",
+    "Close > 'abc'",
+    "Close > True",
+    "Close > 'a' - 1",
+    "Close > 1 + None",
+    "Close > -'a'",
+    "Close > 1 / 0",
+    "Close > 1" + "0" * 200 + " * 1" + "0" * 200,
+    "Close[-16] > 0",
+    "Close[{[1]: 1}] > 0",
+    "Close[{1, []}] > 0",
+    "Close[-True] > 0",
+    "Close" + " + Close" * 3000 + " > 0",
+    "-" * 3000 + "Close > 0",
+    "Close.real > 0",
+    "Price > 0",
+    42
+])
+def test_invalid_formulas_are_rejected(formula):
+    with pytest.raises(ValueError):
+        compile_trigger(formula)
+
+
+def test_refreshing_cache_reloads_entries_past_max_staleness(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    loads = []
+    cache = RefreshingCache(lambda key: loads.append(key) or len(loads), ttl=60)
+    cache.executor.submit = lambda *args: None  # background refresh never lands
+    assert cache.get("k") == 1
+    now[0] += 90
+    assert cache.get("k") == 1  # stale but within the cap: served while refreshing
+    now[0] += 60
+    assert cache.get("k") == 2  # past 2x ttl: reloaded synchronously
+
+
+class FakeSession:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.posts = 0
+
+    def post(self, url, data, timeout):
+        self.posts += 1
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response._content = b'{"parameters": {"retry_after": 0}}'
+        return response
+
+
+@pytest.fixture
+def telegram_bucket(monkeypatch):
+    bucket = TokenBucket(rate=1000, capacity=1000, min_rate=1)
+    monkeypatch.setattr(scanner, "telegram_bucket", bucket)
+    return bucket
+
+
+def test_send_telegram_retries_rate_limits(telegram_bucket):
+    session = FakeSession(429, 200)
+    send_telegram(session, "token", "chat", "message")
+    assert session.posts == 2
+
+
+@pytest.mark.parametrize("statuses", [(400,), (502,), (429, 429, 429)])
+def test_send_telegram_raises_on_failure(telegram_bucket, statuses):
+    telegram_bucket.rate = 10  # below max_rate, so a wrongful increase_rate would show
+    with pytest.raises(requests.HTTPError):
+        send_telegram(FakeSession(*statuses), "token", "chat", "message")
+    assert telegram_bucket.rate <= 10
+
+
+class FakeSmtp:
+    opened = []
+
+    def __init__(self, host, port, timeout):
+        self.closed = False
+        self.sends = 0
+        FakeSmtp.opened.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        if password == "wrong":
+            raise smtplib.SMTPAuthenticationError(535, b"rejected")
+
+    def noop(self):
+        return (250, b"OK")
+
+    def sendmail(self, sender, recipients, message):
+        self.sends += 1
+        if self.sends == 2:
+            raise smtplib.SMTPServerDisconnected()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSmtp.opened = []
+    monkeypatch.setattr(smtplib, "SMTP", FakeSmtp)
+    return FakeSmtp.opened
+
+
+def test_smtp_closes_dropped_connection(fake_smtp):
+    connection = SmtpConnection("user", "password")
+    connection.sendmail(["to"], "first")
+    connection.sendmail(["to"], "second")  # disconnected, so it reconnects and resends
+    assert len(fake_smtp) == 2
+    assert fake_smtp[0].closed and not fake_smtp[1].closed
+
+
+def test_smtp_closes_connection_when_login_fails(fake_smtp):
+    connection = SmtpConnection("user", "wrong")
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        connection.sendmail(["to"], "message")
+    assert fake_smtp[0].closed and connection.server is None